@@ -0,0 +1,40 @@
+#!/usr/bin/python
+
+from Evaluate import Evaluator
+from Surfaces import Parameters, Surfaces
+import argparse
+import numpy
+import timeit
+
+Benchmarks = ['torus', 'ridged', 'superellipse', 'mobius', 'trefoil', 'bicubic']
+
+def Measure(evaluator, size, repeat):
+    """Returns the best vertices per second over several evaluations"""
+    us, vs = evaluator.Grid(size, size)
+    positions = numpy.empty((size, size, 3), numpy.float32)
+    normals = numpy.empty((size, size, 3), numpy.float32)
+    evaluator.Evaluate(us, vs, positions, normals) # <-- allocates buffers
+    timer = timeit.Timer(lambda: evaluator.Evaluate(us, vs, positions, normals))
+    return size * size / min(timer.repeat(repeat, 1))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Reports NumPy evaluation speed of derived surfaces.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+        default=[64, 256, 1024], help='grid resolutions to measure')
+    parser.add_argument('--repeat', type=int, default=5,
+        help='evaluations per measurement; the fastest one is reported')
+    args = parser.parse_args()
+    rows = []
+    for name, derivation, enabled, domain in Surfaces:
+        if name not in Benchmarks:
+            continue
+        label, surface, normals = derivation()
+        evaluator = Evaluator(surface, normals, Parameters, domain)
+        rows.append([label] + [Measure(evaluator, size, args.repeat)
+                               for size in args.sizes])
+    print
+    print '%-20s' % 'Mvertices/s' + \
+        ''.join('%12s' % ('%dx%d' % (s, s)) for s in args.sizes)
+    for row in rows:
+        print '%-20s' % row[0] + ''.join('%12.2f' % (x / 1e6) for x in row[1:])
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+
+from Derive import FrameSweep, Sweep, VVF, u, v
+from Evaluate import Evaluator
+from Export import ExportGltf, ExportPly, PlyFace
+from Polynomial import BSplineBasis, BezierBasis, t
+from Surfaces import CircleYZ, Parameters, Surfaces, R, r
+from sympy import Matrix, cos, expand, lambdify, sin
+import argparse
+import json
+import numpy
+import os
+import shutil
+import sys
+import tempfile
+
+# Sample points, as fractions of the domain, clear of the seams and of the
+# vertical tangents of the superellipses.
+Fractions = numpy.array([0.07, 0.31, 0.53, 0.81])
+
+# Surfaces whose first and last rows of a grid coincide.
+Closed = ['torus', 'ridged', 'superellipse', 'trefoil', 'simpletrefoil',
+          'spiral']
+
+# Grid columns left out of the seam check because the surface is degenerate
+# there: the spiral shrinks to a point at v = 2 pi and has no normal.
+Degenerate = {'spiral': slice(None, -1)}
+
+Failures = []
+
+def Check(name, ok, detail=''):
+    print '%-44s %-6s %s' % (name, 'ok' if ok else 'FAILED', detail)
+    if not ok:
+        Failures.append(name)
+
+def Samples(domain):
+    (u0, u1), (v0, v1) = [(float(a), float(b)) for a, b in domain]
+    return (u0 + (u1 - u0) * Fractions)[:, None], \
+           (v0 + (v1 - v0) * Fractions)[None, :]
+
+def EvaluateAt(evaluator, us, vs):
+    shape = numpy.broadcast(us, vs).shape + (3,)
+    positions, normals = numpy.empty(shape), numpy.empty(shape)
+    evaluator.Evaluate(us, vs, positions, normals)
+    return positions, normals
+
+def Bound(exprs):
+    """Substitutes Parameters, by symbol name, into the expressions"""
+    return [e.xreplace(dict((s, Parameters[s.name]) for s in e.free_symbols
+                            if s.name in Parameters)) for e in exprs]
+
+def CheckPositions(label, surface, evaluator, us, vs):
+    """Kernel against lambdify, which shares none of its code"""
+    positions, normals = EvaluateAt(evaluator, us, vs)
+    f = lambdify((u, v), Bound(list(surface)), 'numpy')
+    expected = numpy.stack(numpy.broadcast_arrays(*f(us, vs)), axis=-1)
+    error = abs(positions - expected).max()
+    Check(label + ' positions', error < 1e-9, '%.1e' % error)
+
+def CheckNormals(label, evaluator, us, vs):
+    """Unit normals against central differences of the positions"""
+    e = 1e-6
+    positions, normals = EvaluateAt(evaluator, us, vs)
+    dpdu = EvaluateAt(evaluator, us + e, vs)[0] - \
+           EvaluateAt(evaluator, us - e, vs)[0]
+    dpdv = EvaluateAt(evaluator, us, vs + e)[0] - \
+           EvaluateAt(evaluator, us, vs - e)[0]
+    expected = numpy.cross(dpdu, dpdv)
+    expected /= numpy.linalg.norm(expected, axis=-1)[..., None]
+    worst = numpy.einsum('...i,...i->...', expected, normals).min()
+    Check(label + ' normals', worst > 1 - 1e-6, 'min dot %.12f' % worst)
+
+def CheckSeam(label, evaluator, columns=slice(None)):
+    """The first and last rows must match, and be finite throughout"""
+    rows, cols = 33, 9
+    with numpy.errstate(invalid='ignore'): # <-- counted below instead
+        positions, normals = EvaluateAt(evaluator,
+                                        *evaluator.Grid(rows, cols))
+    grid = numpy.concatenate([positions, normals], axis=-1)[:, columns]
+    bad = (~numpy.isfinite(grid)).any(axis=-1).sum()
+    gap = abs(grid[0] - grid[-1]).max() # <-- NaN if either row has one
+    detail = '%.1e' % gap
+    if bad:
+        detail += ', %d of %d vertices not finite' % (bad, grid.size // 6)
+    if columns != slice(None):
+        detail += ', degenerate columns left out'
+    Check(label + ' seam', bad == 0 and gap < 1e-9, detail)
+
+def CheckStrips(label, evaluator):
+    """Evaluating rows a strip at a time must not change them"""
+    rows, cols = 33, 9
+    whole = EvaluateAt(evaluator, *evaluator.Grid(rows, cols))[0]
+    strip = EvaluateAt(evaluator, *evaluator.Grid(rows, cols, 13, 7))[0]
+    error = abs(whole[13:20] - strip).max()
+    Check(label + ' strips', error < 1e-12, '%.1e' % error)
+
+def CheckSurface(name, derivation, domain):
+    label, surface, normals = derivation()
+    us, vs = Samples(domain)
+    if isinstance(surface, FrameSweep):
+        for frame in 'frenet', 'rmf':
+            evaluator = Evaluator(surface.WithFrame(frame),
+                                  normals.WithFrame(frame), Parameters, domain)
+            CheckNormals('%s (%s)' % (label, frame), evaluator, us, vs)
+            if name in Closed:
+                CheckSeam('%s (%s)' % (label, frame), evaluator)
+            if frame == 'rmf':
+                CheckStrips('%s (%s)' % (label, frame), evaluator)
+        return
+    evaluator = Evaluator(surface, normals, Parameters, domain)
+    CheckPositions(label, surface, evaluator, us, vs)
+    CheckNormals(label, evaluator, us, vs)
+    if name in Closed:
+        CheckSeam(label, evaluator, Degenerate.get(name, slice(None)))
+
+def CheckRuntimeFrame():
+    """The runtime Frenet frame against the symbolic one, on a torus"""
+    sweepCurve, crossSection = VVF(R*cos(u), R*sin(u), 0), CircleYZ(r)
+    symbolic = Sweep(sweepCurve, crossSection)
+    runtime = Sweep(sweepCurve, crossSection, frame='frenet')
+    us, vs = Samples(((0, 6.28), (0, 6.28)))
+    expected = EvaluateAt(Evaluator(symbolic, symbolic, Parameters),
+                          us, vs)[0]
+    positions = EvaluateAt(Evaluator(runtime, runtime.Normals(), Parameters),
+                           us, vs)[0]
+    error = abs(positions - expected).max()
+    Check('Runtime Frenet frame torus', error < 1e-9, '%.1e' % error)
+
+def ReadPly(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = data.index(b'end_header\n') + len(b'end_header\n')
+    header = data[:end].decode('ascii').split('\n')
+    count = dict((l.split()[1], int(l.split()[2])) for l in header
+                 if l.startswith('element'))
+    width = len([l for l in header if l.startswith('property float')])
+    vertices = numpy.frombuffer(data, numpy.float32,
+                                count['vertex'] * width, end)
+    faces = numpy.frombuffer(data, PlyFace, count['face'],
+                             end + vertices.nbytes)
+    return vertices.reshape(-1, width), faces
+
+def CheckExport(evaluator):
+    """Writes both formats in several strips and reads them back"""
+    rows, cols, strip = 9, 7, 2
+    directory = tempfile.mkdtemp()
+    try:
+        positions, normals = EvaluateAt(evaluator,
+                                        *evaluator.Grid(rows, cols))
+        expected = numpy.concatenate([positions, normals], axis=-1)
+        expected = expected.reshape(-1, 6).astype(numpy.float32)
+        ply = os.path.join(directory, 'mesh.ply')
+        ExportPly(ply, evaluator, rows, cols, strip)
+        vertices, faces = ReadPly(ply)
+        Check('PLY vertices', numpy.allclose(vertices, expected, atol=1e-6))
+        triangles = faces['i']
+        Check('PLY faces', len(faces) == (rows - 1) * (cols - 1) * 2 and
+              (faces['n'] == 3).all() and triangles.max() < rows * cols)
+        a, b, c = [vertices[triangles[:, i], :3] for i in xrange(3)]
+        facing = numpy.einsum('ij,ij->i', numpy.cross(b - a, c - a),
+                              vertices[triangles, 3:].sum(axis=1))
+        Check('PLY winding', (facing > 0).all())
+        gltf = os.path.join(directory, 'mesh.gltf')
+        ExportGltf(gltf, evaluator, rows, cols, strip)
+        with open(gltf) as f:
+            document = json.load(f)
+        with open(os.path.join(directory, document['buffers'][0]['uri']),
+                  'rb') as f:
+            binary = f.read()
+        vertexBytes = document['bufferViews'][0]['byteLength']
+        interleaved = numpy.frombuffer(binary, numpy.float32,
+                                       vertexBytes // 4).reshape(-1, 6)
+        indices = numpy.frombuffer(binary, '<u4', offset=vertexBytes)
+        accessor = document['accessors'][0]
+        Check('glTF vertices', numpy.array_equal(interleaved, vertices) and
+              accessor['count'] == rows * cols and
+              numpy.allclose(accessor['min'], vertices[:, :3].min(axis=0)) and
+              numpy.allclose(accessor['max'], vertices[:, :3].max(axis=0)))
+        Check('glTF indices', len(binary) ==
+              document['buffers'][0]['byteLength'] and
+              numpy.array_equal(indices, triangles.ravel()))
+    finally:
+        shutil.rmtree(directory)
+
+def CheckBases():
+    """Each basis is a partition of unity"""
+    for name, basis in [('Bezier', BezierBasis(3)),
+                        ('B-spline', BSplineBasis(3)),
+                        ('quadratic B-spline', BSplineBasis(2))]:
+        degree = basis.rows - 1
+        powers = Matrix(1, degree + 1, [t**(degree - i)
+                                        for i in xrange(degree + 1)])
+        total = expand((powers * basis * Matrix([1] * (degree + 1)))[0])
+        Check('%s basis sums to 1' % name, total == 1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Checks evaluation, runtime frames, export and bases '
+                    'against independent computations on tiny grids.')
+    parser.add_argument('names', nargs='*', metavar='name',
+        help='surfaces to check (default: all)')
+    args = parser.parse_args()
+    names = args.names or [s[0] for s in Surfaces]
+    for name in names:
+        if name not in [s[0] for s in Surfaces]:
+            parser.error('unknown surface: ' + name)
+    for name, derivation, enabled, domain in Surfaces:
+        if name in names:
+            CheckSurface(name, derivation, domain)
+    CheckRuntimeFrame()
+    label, surface, normals = dict((s[0], s[1]) for s in Surfaces)['torus']()
+    CheckExport(Evaluator(surface, normals, Parameters))
+    CheckBases()
+    print
+    print '%d failed' % len(Failures) if Failures else 'all passed'
+    sys.exit(1 if Failures else 0)
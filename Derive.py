@@ -1,62 +1,493 @@
 #!/usr/bin/python
 
-from sympy import diff, simplify, symbols, trigsimp
+from sympy import Add, Dummy, Mul, cancel, count_ops, cse, diff, \
+                  expand_mul, factor_terms, powsimp, simplify, srepr, \
+                  symbols, trigsimp
 from sympy.matrices import *
-from sympy.functions import sin,cos
-import sys
+from sympy.functions import sin,cos,sign,DiracDelta
+import sympy
+import contextlib
+import copy
+import functools
+import hashlib
+import inspect
+import multiprocessing
+import os
+import pickle
+import resource
+import signal
+import time
 
-def Progress():
-    sys.stdout.write('.')
-    sys.stdout.flush()
+# Instrumentation.
+# Every hook is called with a dict per event: 'stage' when a stage ends,
+# with its seconds and how many MB it raised the peak memory of the process
+# by, 'simplify' per simplified matrix entry, 'cache' per cached derivation.
+# Each event carries the path of the stages it happened in.
+Hooks = []
+Stages = []
+
+# Seconds a stage may take before it is abandoned; None for no limit.
+# Time spent in nested stages does not count against the enclosing one,
+# so the error always names the stage that actually ran over.
+# The deadline interrupts the sympy calls made through Attempt and Guarded
+# (simplification, cse, diff, count_ops and the matrix algebra of Sweep and
+# NormalFunc), and the wait for pool results. It cannot interrupt the rest:
+# building expressions in Surfaces.py, xreplace, Freeze and Thaw, or the
+# work of pool workers; a stage stuck there fails at its next guarded call.
+StageTimeout = None
+Deadline = None
+
+class DerivationError(Exception):
+    pass
+
+def Emit(event, **fields):
+    fields['event'] = event
+    fields['stage'] = '/'.join(Stages)
+    for hook in Hooks:
+        hook(fields)
+
+def PeakMemory():
+    """Peak resident memory of this process in megabytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def Depth(e):
+    return 1 + max([Depth(a) for a in e.args] or [0])
+
+def Overrun():
+    return DerivationError('%s took over %s seconds' %
+                           ('/'.join(Stages), StageTimeout))
+
+def Remaining():
+    """Seconds left before the innermost stage deadline, or None"""
+    if Deadline is None:
+        return None
+    remaining = Deadline - time.time()
+    if remaining <= 0:
+        raise Overrun()
+    return remaining
+
+@contextlib.contextmanager
+def Stage(name):
+    """Times a named step of a derivation and guards it against  """
+    """running over StageTimeout or recursing too deeply in sympy"""
+    global Deadline
+    previous = Deadline
+    start = time.time()
+    peak = PeakMemory()
+    if StageTimeout:
+        Deadline = start + StageTimeout
+    Stages.append(name)
+    try:
+        yield
+    except RuntimeError as error:
+        raise DerivationError('%s: %s' % ('/'.join(Stages), error))
+    finally:
+        seconds = time.time() - start
+        Emit('stage', seconds=seconds, peak_growth=PeakMemory() - peak)
+        Stages.pop()
+        Deadline = previous and previous + seconds # <-- paused meanwhile
+
+# On-disk derivation cache.
+# Set DERIVE_CACHE to an empty string to disable it.
+CacheDir = os.environ.get('DERIVE_CACHE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.derive_cache'))
+CacheLimit = 256 * 1024 * 1024
+
+# The derivations live in this file, so any edit to it invalidates the cache.
+with open(os.path.splitext(os.path.abspath(__file__))[0] + '.py', 'rb') as f:
+    CacheVersion = hashlib.sha1(f.read()).hexdigest()
+
+def CacheKey(name, *args):
+    """Content address for a derivation: the sympy version, the source  """
+    """of this file, the simplification settings, the name of the       """
+    """deriving function and the srepr of all its inputs                """
+    h = hashlib.sha1()
+    h.update(sympy.__version__.encode('utf-8'))
+    h.update(CacheVersion.encode('utf-8'))
+    h.update(repr((SimplifyBudget, SimplifyTimeout)).encode('utf-8'))
+    h.update(name.encode('utf-8'))
+    for a in args:
+        h.update(srepr(a).encode('utf-8'))
+    return h.hexdigest()
+
+def EvictCache():
+    """Removes the least recently used entries until the cache fits"""
+    entries = []
+    for name in os.listdir(CacheDir):
+        path = os.path.join(CacheDir, name)
+        if name.endswith('.pickle'):
+            try:
+                stat = os.stat(path)
+            except OSError: # <-- evicted by another process meanwhile
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(e[1] for e in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= CacheLimit:
+            break
+        Discard(path)
+        total -= size
+
+def Discard(path):
+    """Removes a cache entry, unless another process already did"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def Cached(func):
+    """Memoizes a derivation on disk, keyed on the srepr of its arguments"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not CacheDir:
+            with Stage(func.__name__):
+                return Thaw(Freeze(func(*args, **kwargs)))
+        callargs = inspect.getcallargs(func, *args, **kwargs)
+        key = CacheKey(func.__name__, sorted(callargs.items()))
+        path = os.path.join(CacheDir, key + '.pickle')
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    result = Thaw(pickle.load(f))
+            except Exception:
+                Discard(path)
+            else:
+                try:
+                    os.utime(path, None) # <-- bump for LRU eviction
+                except OSError:
+                    pass
+                Emit('cache', function=func.__name__, key=key, hit=True)
+                return result
+        Emit('cache', function=func.__name__, key=key, hit=False)
+        timeouts = Timeouts
+        with Stage(func.__name__):
+            result = func(*args, **kwargs)
+        result = Freeze(result)
+        if Timeouts > timeouts: # <-- a faster run may do better
+            return Thaw(result)
+        try:
+            os.makedirs(CacheDir)
+        except OSError: # <-- exists, perhaps made by another process
+            pass
+        temp = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump(result, f, 2)
+        os.rename(temp, path)
+        EvictCache()
+        return Thaw(result)
+    return wrapper
+
+# Simplification levels:
+#  0 - no simplification at all
+#  1 - cheap targeted passes only (trigsimp, cancel, factor_terms)
+#  2 - cheap passes, then again on each common subexpression, then a full
+#      simplify for entries that still exceed SimplifyBudget operations
+#  3 - full simplify on every entry (the slowest, smallest output)
+# Each pass is abandoned after SimplifyTimeout seconds, or if sympy recurses
+# too deeply, in which case the previous form of the expression is kept.
+# Timeouts counts the passes abandoned so far; derivations that ran into
+# one depend on the speed of the machine and are not cached.
+SimplifyBudget = 100
+SimplifyTimeout = 30
+Timeouts = 0
+
+class Timeout(Exception):
+    pass
+
+@contextlib.contextmanager
+def Alarm(seconds):
+    """Raises Timeout in the enclosed code after the given seconds"""
+    def expired(signum, frame):
+        raise Timeout()
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def Attempt(func, e):
+    """Applies a simplification pass, falling back to e on failure"""
+    seconds = SimplifyTimeout
+    remaining = Remaining()
+    stageExpiring = remaining is not None and remaining < seconds
+    if stageExpiring:
+        seconds = remaining
+    try:
+        with Alarm(seconds):
+            return func(e)
+    except Timeout:
+        if stageExpiring:
+            raise Overrun()
+        global Timeouts
+        Timeouts += 1
+        return e
+    except RuntimeError:
+        return e
+
+def Guarded(func, *args):
+    """Calls func, abandoning the stage if it runs past the deadline"""
+    remaining = Remaining()
+    if remaining is None:
+        return func(*args)
+    try:
+        with Alarm(remaining):
+            return func(*args)
+    except Timeout:
+        raise Overrun()
+
+def CheapSimplify(e):
+    for func in trigsimp, cancel, factor_terms:
+        e = Attempt(func, e)
+    return e
+
+def CseSimplify(e):
+    """Runs the cheap passes on each common subexpression separately"""
+    replacements, reduced = Guarded(cse, e)
+    e = CheapSimplify(reduced[0])
+    for s, x in reversed(replacements):
+        e = e.xreplace({s: CheapSimplify(x)})
+    return CheapSimplify(e)
+
+def SimplifyExpr(e, level=2):
+    if level <= 0:
+        return e
+    if level >= 3:
+        return Attempt(simplify, e)
+    e = CheapSimplify(e)
+    if level >= 2:
+        e = CseSimplify(e)
+        if Guarded(count_ops, e) > SimplifyBudget:
+            full = Attempt(simplify, e)
+            if Guarded(count_ops, full) < Guarded(count_ops, e):
+                e = full
+    return e
+
+# Sympy expressions cross process boundaries and the cache as their srepr.
+# Pickled sympy objects do not always unpickle in another process, and
+# rebuilding them there need not give the same form as the original; so
+# every pool job and derivation result is frozen and thawed, even when it
+# stays put.
+class Srepr(str):
+    """A frozen sympy expression"""
+
+class FrozenMatrix(object):
+    def __init__(self, rows, cols, entries):
+        self.rows, self.cols, self.entries = rows, cols, entries
+
+def Freeze(obj):
+    """Replaces the sympy objects in obj, which may be nested in lists,"""
+    """tuples and FrameSweeps, by picklable srepr strings.            """
+    if isinstance(obj, MatrixBase):
+        return FrozenMatrix(obj.rows, obj.cols, [Freeze(e) for e in obj])
+    if isinstance(obj, sympy.Basic):
+        return Srepr(srepr(obj))
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(Freeze(x) for x in obj)
+    if isinstance(obj, FrameSweep):
+        result = copy.copy(obj)
+        result.__dict__ = dict((k, Freeze(x)) for k, x in vars(obj).items())
+        return result
+    return obj
+
+def Thaw(obj):
+    """Rebuilds the sympy objects in something returned by Freeze"""
+    if isinstance(obj, FrozenMatrix):
+        return Matrix(obj.rows, obj.cols, [Thaw(e) for e in obj.entries])
+    if isinstance(obj, Srepr):
+        return eval(obj, vars(sympy))
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(Thaw(x) for x in obj)
+    if isinstance(obj, FrameSweep):
+        result = copy.copy(obj)
+        result.__dict__ = dict((k, Thaw(x)) for k, x in vars(obj).items())
+        return result
+    return obj
+
+# Optional process pool for entry-wise derivation work.
+# Results are always gathered in entry order, so output is deterministic.
+# Without a stage deadline, PoolTimeout bounds the wait for a result, so a
+# worker that dies cannot hang the run.
+Pool = None
+PoolTimeout = 60 * 60
+
+def UseProcessPool(processes=None):
+    """Farms matrix entries out to the given number of processes"""
+    """(all cores by default); pass 1 to go back to a single core"""
+    global Pool
+    if Pool:
+        Pool.terminate()
+        Pool = None
+    if processes != 1:
+        Pool = multiprocessing.Pool(processes)
+
+def Apply(job):
+    """Runs a frozen job, returning its frozen result along with the """
+    """Timeouts it ran into                                          """
+    timeouts = Timeouts
+    value = job[0](*Thaw(job[1:]))
+    return Freeze(value), Timeouts - timeouts
+
+def MapEntries(func, m, *args):
+    """Returns a matrix of func(entry, *args) for every entry of m"""
+    global Timeouts
+    jobs = [(func, Freeze(e)) + Freeze(args) for e in m]
+    if Pool:
+        try:
+            results = Pool.map_async(Apply, jobs).get(Remaining() or
+                                                      PoolTimeout)
+        except multiprocessing.TimeoutError:
+            Remaining() # <-- raises DerivationError once past the deadline
+            raise DerivationError('%s: no result from the pool within %d '
+                                  'seconds' % ('/'.join(Stages), PoolTimeout))
+        values = [Thaw(value) for value, timeouts in results]
+        Timeouts += sum(timeouts for value, timeouts in results)
+    else:
+        values = [Thaw(Apply(job)[0]) for job in jobs]
+    return Matrix(m.rows, m.cols, values)
 
 # Vector-valued function utilities:
 def VVF(*args):
     return Matrix(args)
 def DVVF(m, variable):
-    return m.applyfunc(lambda f: diff(f,variable))
-def Simplify(m):
-    m.simplify()
-    return m
-def Normalized(m):
-    m = Simplify(m)
-    return Simplify(m / simplify(m.norm()))
+    return MapEntries(Differentiate, m, variable)
+
+# Derivatives of sign() and Abs() bring in DiracDelta terms and powers of
+# sign(); both only matter where the argument is zero, so drop them.
+def Differentiate(f, variable):
+    f = Guarded(diff, f, variable).replace(DiracDelta, lambda *args: 0)
+    return f.replace(lambda e: e.is_Pow and isinstance(e.base, sign) and
+                               e.exp.is_Integer and e.exp > 0,
+                     lambda e: e.base ** (e.exp % 2))
+def Simplify(m, level=2):
+    result = MapEntries(SimplifyExpr, m, level)
+    if Hooks:
+        for i, (before, after) in enumerate(zip(m, result)):
+            Emit('simplify', entry=i, level=level,
+                 ops_before=Guarded(count_ops, before),
+                 ops_after=Guarded(count_ops, after),
+                 depth_before=Guarded(Depth, before),
+                 depth_after=Guarded(Depth, after))
+    return result
+def Normalized(m, level=2):
+    m = Simplify(m, level)
+    with Stage('norm'):
+        norm = Simplify(Matrix([Guarded(m.norm)]), level)[0]
+    return Simplify(m / norm, level)
 
 u, v = symbols('u v', positive=True)
 
-def Sweep(sweepCurve, crossSection):
+# Frames that Sweep can leave to be computed at runtime:
+#  'frenet' - the Frenet frame, the same frame as the symbolic Sweep
+#  'rmf'    - a rotation-minimizing frame, which does not flip at
+#             inflections; available in NumPy only, see Evaluate.py
+RuntimeFrames = ('frenet', 'rmf')
+
+class FrameSweep(object):
+    """A sweep whose frame is computed at runtime rather than derived.  """
+    """Holds the sweep curve with its first three derivatives in u, and """
+    """the cross section with its partial derivatives in u and v.       """
+    """normals tells whether this stands for the surface or its normals."""
+
+    def __init__(self, curve, derivatives, section, sectionDerivatives,
+                 frame, normals=False):
+        self.curve = curve
+        self.velocity, self.acceleration, self.jerk = derivatives
+        self.section = section
+        self.sectionU, self.sectionV = sectionDerivatives
+        self.frame = frame
+        self.normals = normals
+
+    def Normals(self):
+        """Returns the same sweep, standing for its normals"""
+        result = copy.copy(self)
+        result.normals = True
+        return result
+
+    def WithFrame(self, frame):
+        """Returns the same sweep with a different runtime frame"""
+        if frame not in RuntimeFrames:
+            raise ValueError('Unknown frame: %s' % frame)
+        result = copy.copy(self)
+        result.frame = frame
+        return result
+
+@Cached
+def Sweep(sweepCurve, crossSection, level=2, frame=None):
     """Takes two vector-valued functions: """
     """ - sweepCurve is a function of u   """
     """ - crossSection is a function of v """
+    """level selects the simplification   """
+    """strategy, see SimplifyExpr         """
+    """frame, one of RuntimeFrames, skips """
+    """the symbolic frame and returns a   """
+    """FrameSweep instead                 """
+
+    if frame is not None:
+        return RuntimeSweep(sweepCurve, crossSection, level, frame)
 
     # Compute first-order and second-order derivatives:
-    d = DVVF(sweepCurve,u)
-    dd = DVVF(d,u)
+    with Stage('derivatives'):
+        d = DVVF(sweepCurve,u)
+        dd = DVVF(d,u)
 
     # Perform Gram-Schmidt orthogonalization:
     # Does NOT assume the sweep is an arc-length parameterization.
-    Progress()
-    t = Normalized(d)
-    Progress()
-    n = Normalized(dd - t * dd.dot(t))
-    Progress()
-    b = Normalized(t.cross(n).transpose())
-    Progress()
+    with Stage('tangent'):
+        t = Normalized(d, level)
+    with Stage('normal'):
+        n = Normalized(Guarded(lambda: dd - t * dd.dot(t)), level)
+    with Stage('binormal'):
+        b = Normalized(Guarded(t.cross, n).reshape(3, 1), level)
 
     # Formulate the Frenet Frame:
     curveBasis = t.row_join(n).row_join(b)
 
     # Transform the cross section to the curve's space:
-    s = sweepCurve + curveBasis * crossSection
+    s = Guarded(lambda: sweepCurve + curveBasis * crossSection)
 
     # Simplify and return:
-    s = Simplify(s)
-    print "."
+    with Stage('simplify'):
+        s = Simplify(s, level)
     return s
 
-def NormalFunc(f):
+def RuntimeSweep(sweepCurve, crossSection, level, frame):
+    """Sweep, stopping after differentiation; see FrameSweep"""
+    if frame not in RuntimeFrames:
+        raise ValueError('Unknown frame: %s' % frame)
+    level = min(level, 1) # <-- only the derivatives are ever simplified
+    with Stage('derivatives'):
+        d = DVVF(sweepCurve, u)
+        dd = DVVF(d, u)
+        ddd = DVVF(dd, u)
+        dsdu = DVVF(crossSection, u)
+        dsdv = DVVF(crossSection, v)
+    with Stage('simplify'):
+        derivatives = [Simplify(m, level) for m in (d, dd, ddd)]
+        sectionDerivatives = [Simplify(m, level) for m in (dsdu, dsdv)]
+    return FrameSweep(sweepCurve, derivatives, crossSection,
+                      sectionDerivatives, frame)
+
+@Cached
+def NormalFunc(f, level=2, scale=1):
     """Takes a vector-valued function of u and v"""
     """Computes formula for determining the surface normal at any point"""
-    dfdu = DVVF(f, u)
-    dfdv = DVVF(f, v)
-    return Simplify(dfdu.cross(dfdv))
-
+    """scale, a positive product, multiplies each term of the expanded  """
+    """df/dv; it can cancel singular factors without changing direction """
+    with Stage('derivatives'):
+        dfdu = DVVF(f, u)
+        dfdv = DVVF(f, v)
+        dfdv = Guarded(dfdv.applyfunc, lambda e: Add(*[powsimp(scale * t,
+            combine='exp') for t in Add.make_args(expand_mul(e))]))
+        # While simplifying, the factors of scale and their bases are kept
+        # as symbols; simplify would otherwise turn them back into the
+        # singular quotients that scale was there to cancel.
+        factors = Mul.make_args(scale) if scale != 1 else ()
+        atoms = list(factors) + [p.as_base_exp()[0] for p in factors]
+        placeholders = dict((a, Dummy(positive=True)) for a in atoms)
+        dfdu = dfdu.xreplace(placeholders)
+        dfdv = dfdv.xreplace(placeholders)
+    with Stage('simplify'):
+        normals = Simplify(Guarded(dfdu.cross, dfdv), level)
+    return normals.xreplace(dict((d, a) for a, d in placeholders.items()))
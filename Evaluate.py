@@ -0,0 +1,305 @@
+#!/usr/bin/python
+
+from Derive import FrameSweep, u, v
+from sympy import Abs, Add, Mul, Pow, cse, numbered_symbols, pi, sign
+from sympy.functions import sin, cos, tan, exp, log, asin, acos, atan
+import numpy
+
+Ufuncs = {
+    sin: numpy.sin, cos: numpy.cos, tan: numpy.tan,
+    asin: numpy.arcsin, acos: numpy.arccos, atan: numpy.arctan,
+    exp: numpy.exp, log: numpy.log, Abs: numpy.absolute, sign: numpy.sign,
+}
+
+class Kernel(object):
+    """Compiles a list of expressions in u and v into a flat sequence of """
+    """NumPy ufunc calls.  Common subexpressions are computed once, and  """
+    """intermediate results live in a small set of scratch buffers that  """
+    """are allocated once per grid shape and reused on every call.       """
+
+    def __init__(self, exprs, parameters={}):
+        values = dict((str(k), float(x)) for k, x in parameters.items())
+        exprs = [e.xreplace(dict((s, values[s.name])
+                                 for s in e.free_symbols if s.name in values))
+                 for e in exprs]
+        unbound = set().union(*[e.free_symbols for e in exprs]) - set([u, v])
+        if unbound:
+            raise ValueError('No value for parameters: ' +
+                             ', '.join(sorted(s.name for s in unbound)))
+        self.program = []
+        self.registers = 0
+        self.temps = {}
+        replacements, reduced = cse(exprs, symbols=numbered_symbols('t'))
+        for s, e in replacements:
+            self.temps[s] = self.Emit(e)
+        for i, e in enumerate(reduced):
+            operand = self.Emit(e)
+            last = self.program[-1] if self.program else None
+            if (last and last[2] == operand and
+                    operand not in self.temps.values()):
+                self.program[-1] = last[:2] + (('out', i),)
+            else:
+                self.program.append((numpy.copyto, (operand,), ('out', i)))
+        self.count = self.Allocate()
+        self.buffers = {}
+
+    def Emit(self, e):
+        """Appends instructions for e, returning the operand holding it"""
+        if e in self.temps:
+            return self.temps[e]
+        if e == u or e == v:
+            return e.name
+        if not e.free_symbols:
+            return float(e)
+        if isinstance(e, (Add, Mul)):
+            ufunc = numpy.add if isinstance(e, Add) else numpy.multiply
+            args = [self.Emit(a) for a in e.args]
+            result = self.Instruction(ufunc, args[0], args[1])
+            for a in args[2:]:
+                self.program.append((ufunc, (result, a), result))
+            return result
+        if isinstance(e, Pow):
+            base, exponent = self.Emit(e.base), e.exp
+            if exponent.is_Integer and 1 <= abs(exponent) <= 4:
+                result = base
+                for i in xrange(abs(exponent) - 1):
+                    result = self.Instruction(numpy.multiply, result, base)
+                if exponent < 0:
+                    result = self.Instruction(numpy.divide, 1.0, result)
+                return result
+            if exponent == 0.5:
+                return self.Instruction(numpy.sqrt, base)
+            return self.Instruction(numpy.power, base, self.Emit(exponent))
+        if type(e) in Ufuncs:
+            return self.Instruction(Ufuncs[type(e)], self.Emit(e.args[0]))
+        raise ValueError('Cannot evaluate %s with NumPy' % e)
+
+    def Instruction(self, ufunc, *args):
+        self.registers += 1
+        result = ('r', self.registers - 1)
+        self.program.append((ufunc, args, result))
+        return result
+
+    def Allocate(self):
+        """Maps virtual registers onto as few buffers as possible"""
+        lastUse = {}
+        for index, (ufunc, args, result) in enumerate(self.program):
+            for a in args + (result,):
+                if isinstance(a, tuple) and a[0] == 'r':
+                    lastUse[a] = index
+        free, mapping, count = [], {}, 0
+        program = []
+        for index, (ufunc, args, result) in enumerate(self.program):
+            args = tuple(mapping.get(a, a) for a in args)
+            for a in set(self.program[index][1]):
+                if lastUse.get(a) == index and a != self.program[index][2]:
+                    free.append(mapping[a])
+            if result[0] == 'r' and result not in mapping:
+                if free:
+                    mapping[result] = free.pop()
+                else:
+                    mapping[result] = ('b', count)
+                    count += 1
+            program.append((ufunc, args, mapping.get(result, result)))
+            if lastUse.get(result) == index and result[0] == 'r':
+                free.append(mapping[result])
+        self.program = program
+        return count
+
+    def Evaluate(self, us, vs, outputs):
+        """Writes each expression, evaluated at us and vs, into outputs"""
+        shape = numpy.broadcast(us, vs).shape
+        if shape not in self.buffers:
+            self.buffers[shape] = [numpy.empty(shape) for i in
+                                   xrange(self.count)]
+        buffers = self.buffers[shape]
+        def Operand(a):
+            if a == 'u':
+                return us
+            if a == 'v':
+                return vs
+            if isinstance(a, tuple):
+                return buffers[a[1]] if a[0] == 'b' else outputs[a[1]]
+            return a
+        for ufunc, args, result in self.program:
+            if ufunc is numpy.copyto:
+                numpy.copyto(Operand(result), Operand(args[0]))
+            else:
+                ufunc(*[Operand(a) for a in args], out=Operand(result))
+
+# Rotation-minimizing frames are tabulated at this many samples of the
+# sweep curve; the frame at any other u is one double reflection away from
+# the sample before it, so results do not depend on how a grid is split.
+RmfSamples = 4096
+
+def Dot(a, b):
+    """Dot products of two arrays of vectors along their first axis"""
+    return (a * b).sum(axis=0)
+
+def Reflect(x0, t0, r0, x1, t1):
+    """Carries the frame vector r0 at point x0 with tangent t0 over to  """
+    """x1 with tangent t1, by the double reflection method of Wang et al."""
+    v1 = x1 - x0
+    c1 = Dot(v1, v1)
+    c1 = numpy.where(c1 > 0, c1, 1.0) # <-- no reflection if x1 == x0
+    rL = r0 - (2 / c1) * Dot(v1, r0) * v1
+    tL = t0 - (2 / c1) * Dot(v1, t0) * v1
+    v2 = t1 - tL
+    c2 = Dot(v2, v2)
+    c2 = numpy.where(c2 > 0, c2, 1.0)
+    return rL - (2 / c2) * Dot(v2, rL) * v2
+
+def Accumulate(out, frame, section, scratch):
+    """Adds the frame (three vectors) times section to out, per component"""
+    for i in xrange(3):
+        for j in xrange(3):
+            numpy.multiply(section[j], frame[j][i], out=scratch)
+            numpy.add(out[i], scratch, out=out[i])
+
+class SweepKernel(object):
+    """Evaluates a FrameSweep.  The curve depends on u alone, so it and   """
+    """its frame are computed once per row; only the cross section and   """
+    """the final transform are evaluated at every sample.                """
+
+    def __init__(self, sweep, normals, parameters={},
+                 domain=((0, 2*pi), (0, 2*pi))):
+        curve = [sweep.curve, sweep.velocity, sweep.acceleration, sweep.jerk]
+        section = [sweep.section]
+        if normals:
+            section += [sweep.sectionU, sweep.sectionV]
+        self.curve = Kernel([e for m in curve for e in m], parameters)
+        self.section = Kernel([e for m in section for e in m], parameters)
+        self.normals = normals
+        self.frame = sweep.frame
+        self.buffers = {}
+        if self.frame == 'rmf':
+            self.Tabulate(*[float(x) for x in domain[0]])
+
+    def Curve(self, us):
+        """Returns the curve and its three derivatives at us"""
+        values = numpy.empty((12,) + us.shape)
+        self.curve.Evaluate(us, us, values)
+        return values[0:3], values[3:6], values[6:9], values[9:12]
+
+    def Tabulate(self, u0, u1):
+        """Propagates a rotation-minimizing frame along the whole curve. """
+        """On a closed curve, the angle by which it fails to meet itself """
+        """is spread evenly over u as a constant twist.                  """
+        us = numpy.linspace(u0, u1, RmfSamples)
+        c, d, dd, ddd = self.Curve(us)
+        t = d / numpy.sqrt(Dot(d, d))
+        r = numpy.empty_like(t)
+        first = numpy.cross(numpy.cross(d[:, 0], dd[:, 0]), t[:, 0])
+        if Dot(first, first) < 1e-12: # <-- no curvature, pick any normal
+            first = numpy.cross(t[:, 0], numpy.eye(3)[numpy.argmin(abs(t[:, 0]))])
+        r[:, 0] = first / numpy.sqrt(Dot(first, first))
+        for k in xrange(1, RmfSamples):
+            r[:, k] = Reflect(c[:, k - 1], t[:, k - 1], r[:, k - 1],
+                              c[:, k], t[:, k])
+        self.twist = 0.0
+        gap = numpy.sqrt(Dot(c[:, -1] - c[:, 0], c[:, -1] - c[:, 0]))
+        extent = numpy.ptp(c, axis=1).max()
+        if gap <= 1e-9 * extent and Dot(t[:, -1], t[:, 0]) > 1 - 1e-9:
+            angle = numpy.arctan2(Dot(t[:, 0], numpy.cross(r[:, -1], r[:, 0])),
+                                  Dot(r[:, -1], r[:, 0]))
+            self.twist = angle / (u1 - u0)
+        self.table = u0, (u1 - u0) / (RmfSamples - 1), c, t, r
+
+    def Frame(self, us):
+        """Returns the curve, its velocity, the frame and the frame's  """
+        """derivative in u at us, each as a triple of vector arrays.   """
+        c, d, dd, ddd = self.Curve(us)
+        speed = numpy.sqrt(Dot(d, d))
+        t = d / speed
+        if self.frame == 'rmf':
+            u0, step, tc, tt, tr = self.table
+            k = numpy.clip(((us - u0) / step).astype(int), 0, RmfSamples - 1)
+            r = Reflect(tc[:, k], tt[:, k], tr[:, k], c, t)
+            r -= Dot(r, t) * t
+            r /= numpy.sqrt(Dot(r, r))
+            s = numpy.cross(t, r, axis=0)
+            angle = self.twist * (us - u0)
+            n = r * numpy.cos(angle) + s * numpy.sin(angle)
+            b = s * numpy.cos(angle) - r * numpy.sin(angle)
+            twist = self.twist
+        else:
+            o = numpy.cross(d, dd, axis=0)
+            b = o / numpy.sqrt(Dot(o, o))
+            n = numpy.cross(b, t, axis=0)
+            twist = speed * Dot(o, ddd) / Dot(o, o)
+        dt = (dd - Dot(dd, t) * t) / speed
+        dn = twist * b - Dot(dt, n) * t
+        db = -twist * n - Dot(dt, b) * t
+        return c, d, (t, n, b), (dt, dn, db)
+
+    def Evaluate(self, us, vs, outputs):
+        """Writes the position, and normal, components into outputs"""
+        shape = numpy.broadcast(us, vs).shape
+        if shape not in self.buffers:
+            count = 16 if self.normals else 4
+            self.buffers[shape] = numpy.empty((count,) + shape)
+        buffers = self.buffers[shape]
+        scratch, section = buffers[0], buffers[1:]
+        self.section.Evaluate(us, vs, section)
+        c, d, frame, dframe = self.Frame(us)
+        positions = outputs[:3]
+        for i in xrange(3):
+            numpy.copyto(positions[i], c[i])
+        Accumulate(positions, frame, section[0:3], scratch)
+        if not self.normals:
+            return
+        dpdu, dpdv = section[9:12], section[12:15]
+        for i in xrange(3):
+            numpy.copyto(dpdu[i], d[i])
+        dpdv[...] = 0
+        Accumulate(dpdu, dframe, section[0:3], scratch)
+        Accumulate(dpdu, frame, section[3:6], scratch)
+        Accumulate(dpdv, frame, section[6:9], scratch)
+        normals = outputs[3:]
+        for i in xrange(3):
+            j, k = (i + 1) % 3, (i + 2) % 3
+            numpy.multiply(dpdu[j], dpdv[k], out=normals[i])
+            numpy.multiply(dpdu[k], dpdv[j], out=scratch)
+            numpy.subtract(normals[i], scratch, out=normals[i])
+
+class Evaluator(object):
+    """Evaluates a surface and, optionally, its unit normals over a grid """
+    """of (u, v) samples.  Parameters map symbol names to numbers.       """
+    """The surface may also be a FrameSweep, whose normals are implied.  """
+
+    def __init__(self, surface, normals=None, parameters={},
+                 domain=((0, 2*pi), (0, 2*pi))):
+        if isinstance(surface, FrameSweep):
+            self.kernel = SweepKernel(surface, normals is not None,
+                                      parameters, domain)
+        else:
+            exprs = list(surface) + list(normals if normals is not None
+                                         else [])
+            self.kernel = Kernel(exprs, parameters)
+        self.normals = normals is not None
+        self.domain = [(float(a), float(b)) for a, b in domain]
+        self.lengths = {}
+
+    def Grid(self, rows, cols, first=0, count=None):
+        """Returns u and v for rows [first, first + count) of a rows x cols """
+        """grid over the domain; u varies along rows, v along columns.    """
+        (u0, u1), (v0, v1) = self.domain
+        count = rows - first if count is None else count
+        us = u0 + (u1 - u0) * numpy.arange(first, first + count) / (rows - 1.0)
+        vs = numpy.linspace(v0, v1, cols)
+        return us[:, None], vs[None, :]
+
+    def Evaluate(self, us, vs, positions, normals=None):
+        """Fills positions (and normals) arrays of shape (rows, cols, 3)"""
+        outputs = [positions[..., i] for i in xrange(3)]
+        if self.normals:
+            outputs += [normals[..., i] for i in xrange(3)]
+        self.kernel.Evaluate(us, vs, outputs)
+        if self.normals:
+            shape = normals.shape[:-1]
+            if shape not in self.lengths:
+                self.lengths[shape] = numpy.empty(shape, normals.dtype)
+            length = self.lengths[shape]
+            numpy.einsum('...i,...i->...', normals, normals, out=length)
+            numpy.sqrt(length, out=length)
+            numpy.divide(normals, length[..., None], out=normals)
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+from Derive import FrameSweep, RuntimeFrames
+from Evaluate import Evaluator
+import argparse
+import json
+import numpy
+import os
+
+# Rows of vertices evaluated at a time, unless a strip height is given.
+# Peak memory stays proportional to this no matter how large the mesh is.
+StripVertices = 1 << 20
+
+# PLY triangle record: a count byte followed by three vertex indices.
+PlyFace = numpy.dtype([('n', 'u1'), ('i', '<u4', 3)])
+
+def StripRows(cols, strip):
+    return strip or max(1, StripVertices // cols)
+
+def WriteVertices(path, offset, evaluator, rows, cols, strip):
+    """Streams interleaved float32 positions (and normals) into path at """
+    """offset, a strip of rows at a time.  Returns the position bounds. """
+    width = 6 if evaluator.normals else 3
+    lower = numpy.full(3, numpy.inf)
+    upper = numpy.full(3, -numpy.inf)
+    for first in xrange(0, rows, strip):
+        count = min(strip, rows - first)
+        block = numpy.memmap(path, numpy.float32, 'r+',
+                             offset + first * cols * width * 4,
+                             (count, cols, width))
+        us, vs = evaluator.Grid(rows, cols, first, count)
+        positions = block[..., :3]
+        normals = block[..., 3:] if evaluator.normals else None
+        evaluator.Evaluate(us, vs, positions, normals)
+        lower = numpy.minimum(lower, positions.min(axis=(0, 1)))
+        upper = numpy.maximum(upper, positions.max(axis=(0, 1)))
+        block.flush()
+        del block
+    return lower, upper
+
+def WriteTriangles(path, offset, rows, cols, strip, dtype):
+    """Streams two triangles per grid quad into path at offset, wound   """
+    """counter-clockwise around the normal, a strip of rows at a time.  """
+    """dtype is either PlyFace or a plain unsigned integer type.        """
+    shape = (2,) if dtype.names else (2, 3)
+    size = dtype.itemsize * (1 if dtype.names else 3)
+    for first in xrange(0, rows - 1, strip):
+        count = min(strip, rows - 1 - first)
+        block = numpy.memmap(path, dtype, 'r+',
+                             offset + first * (cols - 1) * 2 * size,
+                             (count, cols - 1) + shape)
+        if dtype.names:
+            block['n'] = 3
+            triangles = block['i']
+        else:
+            triangles = block
+        i = numpy.arange(first, first + count)[:, None]
+        j = numpy.arange(cols - 1)[None, :]
+        a = i * cols + j
+        triangles[:, :, 0, 0] = a
+        triangles[:, :, 0, 1] = a + cols
+        triangles[:, :, 0, 2] = a + cols + 1
+        triangles[:, :, 1, 0] = a
+        triangles[:, :, 1, 1] = a + cols + 1
+        triangles[:, :, 1, 2] = a + 1
+        block.flush()
+        del block
+
+def Allocate(path, header, size):
+    """Creates path with the given header, padded out to size bytes"""
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(size)
+
+def ExportPly(path, evaluator, rows, cols, strip=None):
+    """Writes a binary little-endian PLY of a rows x cols grid"""
+    strip = StripRows(cols, strip)
+    vertices = rows * cols
+    faces = (rows - 1) * (cols - 1) * 2
+    properties = ['x', 'y', 'z'] + (['nx', 'ny', 'nz'] if evaluator.normals else [])
+    header = ['ply', 'format binary_little_endian 1.0',
+              'element vertex %d' % vertices]
+    header += ['property float %s' % p for p in properties]
+    header += ['element face %d' % faces,
+               'property list uchar uint vertex_indices',
+               'end_header', '']
+    header = '\n'.join(header).encode('ascii')
+    vertexBytes = vertices * len(properties) * 4
+    Allocate(path, header, len(header) + vertexBytes + faces * PlyFace.itemsize)
+    WriteVertices(path, len(header), evaluator, rows, cols, strip)
+    WriteTriangles(path, len(header) + vertexBytes, rows, cols, strip, PlyFace)
+
+def ExportGltf(path, evaluator, rows, cols, strip=None):
+    """Writes a glTF 2.0 file plus a .bin buffer next to it, holding the """
+    """interleaved vertices followed by 32-bit triangle indices.         """
+    strip = StripRows(cols, strip)
+    vertices = rows * cols
+    faces = (rows - 1) * (cols - 1) * 2
+    stride = 24 if evaluator.normals else 12
+    binary = os.path.splitext(path)[0] + '.bin'
+    vertexBytes = vertices * stride
+    Allocate(binary, b'', vertexBytes + faces * 12)
+    lower, upper = WriteVertices(binary, 0, evaluator, rows, cols, strip)
+    WriteTriangles(binary, vertexBytes, rows, cols, strip,
+                   numpy.dtype('<u4'))
+    attributes = {'POSITION': 0}
+    accessors = [{'bufferView': 0, 'byteOffset': 0, 'componentType': 5126,
+                  'count': vertices, 'type': 'VEC3',
+                  'min': lower.tolist(), 'max': upper.tolist()}]
+    if evaluator.normals:
+        attributes['NORMAL'] = 2
+        accessors.append({'bufferView': 0, 'byteOffset': 12,
+                          'componentType': 5126, 'count': vertices,
+                          'type': 'VEC3'})
+    accessors.insert(1, {'bufferView': 1, 'componentType': 5125,
+                         'count': faces * 3, 'type': 'SCALAR'})
+    gltf = {
+        'asset': {'version': '2.0'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0}],
+        'meshes': [{'primitives': [{'attributes': attributes,
+                                    'indices': 1, 'mode': 4}]}],
+        'buffers': [{'uri': os.path.basename(binary),
+                     'byteLength': vertexBytes + faces * 12}],
+        'bufferViews': [
+            {'buffer': 0, 'byteOffset': 0, 'byteLength': vertexBytes,
+             'byteStride': stride, 'target': 34962},
+            {'buffer': 0, 'byteOffset': vertexBytes,
+             'byteLength': faces * 12, 'target': 34963}],
+        'accessors': accessors,
+    }
+    with open(path, 'w') as f:
+        json.dump(gltf, f, indent=1)
+
+if __name__ == '__main__':
+    from Surfaces import Parameters, Surfaces
+    parser = argparse.ArgumentParser(
+        description='Bakes a derived surface into a PLY or glTF mesh.')
+    parser.add_argument('name', choices=[s[0] for s in Surfaces])
+    parser.add_argument('output', help='a .ply or .gltf filename')
+    parser.add_argument('--rows', type=int, default=1024,
+        help='samples along u')
+    parser.add_argument('--cols', type=int, default=1024,
+        help='samples along v')
+    parser.add_argument('--strip', type=int, default=None,
+        help='rows evaluated at a time (default: about %d vertices)' %
+             StripVertices)
+    parser.add_argument('--frame', choices=RuntimeFrames,
+        help='frame for sweeps whose frame is computed at runtime')
+    args = parser.parse_args()
+    name, derivation, enabled, domain = \
+        [s for s in Surfaces if s[0] == args.name][0]
+    label, surface, normals = derivation()
+    if args.frame:
+        if not isinstance(surface, FrameSweep):
+            parser.error('%s has no runtime frame' % name)
+        surface = surface.WithFrame(args.frame)
+        normals = normals.WithFrame(args.frame)
+    evaluator = Evaluator(surface, normals, Parameters, domain)
+    export = ExportGltf if args.output.endswith('.gltf') else ExportPly
+    export(args.output, evaluator, args.rows, args.cols, args.strip)
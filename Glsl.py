@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+from Derive import FrameSweep
+from sympy import count_ops, cse, numbered_symbols
+from sympy.printing.glsl import GLSLPrinter # <-- sympy 1.3 or newer
+from sympy.printing.precedence import precedence
+import re
+
+# Integer powers up to this exponent are written out as multiplications.
+# GLSL's pow() is undefined for negative bases and costs an exp and a log.
+MaxPowerExpansion = 4
+
+class Printer(GLSLPrinter):
+    def _print_Pow(self, expr):
+        base, exp = expr.as_base_exp()
+        if exp.is_Integer and 2 <= abs(exp) <= MaxPowerExpansion:
+            factor = self.parenthesize(base, precedence(expr))
+            product = '*'.join([factor] * abs(int(exp)))
+            if exp < 0:
+                return '1.0/(%s)' % product
+            return product
+        return GLSLPrinter._print_Pow(self, expr)
+
+def OpCount(exprs):
+    """Number of operations in a sequence of expressions"""
+    return sum(count_ops(e) for e in exprs)
+
+def FunctionName(label):
+    """Turns a label like 'Ridged Torus Surface' into 'RidgedTorusSurface'"""
+    words = re.findall('[A-Za-z0-9]+', label)
+    return ''.join(w[0].upper() + w[1:] for w in words)
+
+def GlslFunction(name, vvf, subroutine='ParametricFunction'):
+    """Emits a GLSL subroutine that evaluates a vector-valued function of"""
+    """u and v, with common subexpressions of x, y and z computed once.  """
+    """Returns the source along with the op counts before and after CSE. """
+    if isinstance(vvf, FrameSweep):
+        return GlslFrameSweep(name, vvf, subroutine)
+    components = list(vvf)
+    free = set().union(*[e.free_symbols for e in components])
+    temps = numbered_symbols('t', exclude=free)
+    replacements, reduced = cse(components, symbols=temps)
+    before = OpCount(components)
+    after = OpCount([e for s, e in replacements] + reduced)
+
+    printer = Printer()
+    lines = [
+        'subroutine(%s)' % subroutine,
+        'vec3 %s(float u, float v)' % name,
+        '{']
+    for s, e in replacements:
+        lines.append('    float %s = %s;' % (s, printer.doprint(e)))
+    for axis, e in zip('xyz', reduced):
+        lines.append('    float %s = %s;' % (axis, printer.doprint(e)))
+    lines.append('    return vec3(x, y, z);')
+    lines.append('}')
+    return '\n'.join(lines), before, after
+
+# Vectors that a FrameSweep subroutine computes from its derivatives.
+# The Frenet frame is (tangent, normal, binormal); dtangent and friends
+# are its derivatives in u, which follow from the Frenet-Serret formulas
+# given the speed and the twist rate (speed times torsion).
+FrenetFrame = [
+    'float speed = length(velocity);',
+    'vec3 tangent = velocity / speed;',
+    'vec3 osculating = cross(velocity, acceleration);',
+    'vec3 binormal = normalize(osculating);',
+    'vec3 normal = cross(binormal, tangent);',
+    'mat3 frame = mat3(tangent, normal, binormal);']
+FrenetDerivatives = [
+    'float twist = speed * dot(osculating, jerk) / dot(osculating, osculating);',
+    'vec3 dtangent = (acceleration - dot(acceleration, tangent) * tangent) / speed;',
+    'vec3 dnormal = twist * binormal - dot(dtangent, normal) * tangent;',
+    'vec3 dbinormal = -twist * normal;',
+    'mat3 dframe = mat3(dtangent, dnormal, dbinormal);',
+    'vec3 dpdu = velocity + dframe * section + frame * sectionU;',
+    'vec3 dpdv = frame * sectionV;']
+
+def GlslFrameSweep(name, sweep, subroutine):
+    """Emits a GLSL subroutine for a FrameSweep: the derivatives are     """
+    """written out as expressions, the frame is computed with normalize  """
+    """and cross at runtime.  Returns the same triple as GlslFunction.   """
+    vectors = [('velocity', sweep.velocity),
+               ('acceleration', sweep.acceleration),
+               ('section', sweep.section)]
+    if sweep.normals:
+        vectors += [('jerk', sweep.jerk), ('sectionU', sweep.sectionU),
+                    ('sectionV', sweep.sectionV)]
+    else:
+        vectors.insert(0, ('curve', sweep.curve))
+    components = [e for n, m in vectors for e in m]
+    free = set().union(*[e.free_symbols for e in components])
+    temps = numbered_symbols('t', exclude=free)
+    replacements, reduced = cse(components, symbols=temps)
+    before = OpCount(components)
+    after = OpCount([e for s, e in replacements] + reduced)
+
+    printer = Printer()
+    lines = [
+        'subroutine(%s)' % subroutine,
+        'vec3 %s(float u, float v)' % name,
+        '{']
+    if sweep.frame != 'frenet':
+        lines.append('    // %s frames need the whole curve; '
+                     'using the Frenet frame' % sweep.frame)
+    for s, e in replacements:
+        lines.append('    float %s = %s;' % (s, printer.doprint(e)))
+    for i, (vector, m) in enumerate(vectors):
+        lines.append('    vec3 %s = vec3(%s);' % (vector, ', '.join(
+            printer.doprint(e) for e in reduced[3 * i:3 * i + 3])))
+    lines += ['    ' + line for line in FrenetFrame]
+    if sweep.normals:
+        lines += ['    ' + line for line in FrenetDerivatives]
+        lines.append('    return cross(dpdu, dpdv);')
+    else:
+        lines.append('    return curve + frame * section;')
+    lines.append('}')
+    return '\n'.join(lines), before, after
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+
+from Derive import u, v, VVF
+from sympy import Matrix, Poly, S, binomial, factorial, symbols
+
+# Basis matrices follow the convention of the original bicubic patch:
+# row i holds the coefficients of t^(degree - i), column j belongs to the
+# j-th control point, so a curve is [t^d ... t 1] * M * [P0 ... Pd]^T.
+
+t = symbols('t')
+
+def BasisMatrix(functions):
+    degree = len(functions) - 1
+    columns = [Poly(f, t).all_coeffs() for f in functions]
+    columns = [[0] * (degree + 1 - len(c)) + c for c in columns]
+    return Matrix(degree + 1, degree + 1, lambda i, j: columns[j][i])
+
+def BezierBasis(degree):
+    """Power-basis matrix of the Bernstein polynomials"""
+    return BasisMatrix([binomial(degree, j) * t**j * (1 - t)**(degree - j)
+                        for j in xrange(degree + 1)])
+
+def BSplineBasis(degree):
+    """Power-basis matrix of one span of a uniform B-spline"""
+    # The uniform B-spline of the given degree with knots 0, 1, ... is
+    # sum((-1)^k C(d+1, k) (x - k)_+^d) / d!; control point j sees the
+    # piece of it that lies over [d - j, d - j + 1].
+    d = degree
+    return BasisMatrix([sum((-1)**k * binomial(d + 1, k) * (t + d - j - k)**d
+                            for k in xrange(d - j + 1)) / factorial(d)
+                        for j in xrange(d + 1)])
+
+def PatchPolys(basisU, basisV, controlPoints):
+    """Returns a Poly in u and v for each of the given matrices of control"""
+    """points, found by sparse coefficient arithmetic: no simplify needed."""
+    du, dv = basisU.rows - 1, basisV.rows - 1
+    polys = []
+    for P in controlPoints:
+        C = basisU * P * basisV.transpose()
+        terms = dict(((du - i, dv - j), C[i, j])
+                     for i in xrange(du + 1) for j in xrange(dv + 1)
+                     if C[i, j] != 0)
+        polys.append(Poly.from_dict(terms, u, v))
+    return polys
+
+def Horner(p):
+    """Nests a Poly in u and v as Horner form in u, whose coefficients"""
+    """are in Horner form in v.                                       """
+    terms = dict(p.terms())
+    du = max(i for i, j in terms)
+    dv = max(j for i, j in terms)
+    e = S.Zero
+    for i in xrange(du, -1, -1):
+        c = S.Zero
+        for j in xrange(dv, -1, -1):
+            c = c * v + terms.get((i, j), 0)
+        e = e * u + c
+    return e
+
+def PolynomialPatch(basisU, basisV, controlPoints):
+    """Takes basis matrices for u and v, and x, y and z control point  """
+    """matrices.  Returns the surface and its normals as vector-valued """
+    """functions in Horner form, ready for Print or an Evaluator.      """
+    """The normals are left as the cross product of the Horner-form    """
+    """partial derivatives; expanding it would square the term count.  """
+    polys = PatchPolys(basisU, basisV, controlPoints)
+    surface = VVF(*[Horner(p) for p in polys])
+    dfdu = VVF(*[Horner(p.diff(u)) for p in polys])
+    dfdv = VVF(*[Horner(p.diff(v)) for p in polys])
+    return surface, dfdu.cross(dfdv).reshape(3, 1)
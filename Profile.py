@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+from collections import OrderedDict
+import json
+import sys
+
+# Hooks for Derive.Hooks; see Derive.Emit for the events they receive.
+
+def JsonLines(stream):
+    """Returns a hook that writes every event to stream as a JSON line"""
+    def hook(event):
+        stream.write(json.dumps(event, sort_keys=True) + '\n')
+        stream.flush()
+    return hook
+
+class Summary(object):
+    """Hook that totals time, memory and simplification per stage.   """
+    """Stages of cached derivations also count their cache hits and  """
+    """misses; a hit runs nothing, so its row has no time or op counts."""
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.errors = []
+
+    def Row(self, stage):
+        names = stage.split('/')
+        for i in xrange(1, len(names) + 1): # <-- parents first
+            path = '/'.join(names[:i])
+            if path not in self.stages:
+                self.stages[path] = dict(calls=0, seconds=0.0, memory=0.0,
+                                         before=0, after=0, depth=0,
+                                         worst='', worstOps=0, hits=0,
+                                         misses=0)
+        return self.stages[stage]
+
+    def __call__(self, event):
+        if event['event'] == 'stage':
+            row = self.Row(event['stage'])
+            row['calls'] += 1
+            row['seconds'] += event['seconds']
+            row['memory'] = max(row['memory'], event['peak_growth'])
+        elif event['event'] == 'simplify':
+            row = self.Row(event['stage'])
+            row['before'] += event['ops_before']
+            row['after'] += event['ops_after']
+            row['depth'] = max(row['depth'], event['depth_after'])
+            if event['ops_after'] >= row['worstOps']:
+                row['worstOps'] = event['ops_after']
+                row['worst'] = '[%d]' % event['entry']
+        elif event['event'] == 'cache':
+            stage = '/'.join(filter(None, [event['stage'], event['function']]))
+            row = self.Row(stage)
+            row['hits' if event['hit'] else 'misses'] += 1
+        elif event['event'] == 'error':
+            self.errors.append(event)
+
+    def Print(self, stream=sys.stderr):
+        width = max([len(s) for s in self.stages] + [5])
+        header = '%-*s %5s %9s %9s %9s %6s %6s %8s %9s' % (width, 'stage',
+            'calls', 'seconds', 'ops in', 'ops out', 'depth', 'worst',
+            'peak +MB', 'hit/miss')
+        stream.write(header + '\n' + '-' * len(header) + '\n')
+        for stage, row in self.stages.items():
+            cache = ''
+            if row['hits'] or row['misses']:
+                cache = '%d/%d' % (row['hits'], row['misses'])
+            stream.write('%-*s %5d %9.2f %9d %9d %6d %6s %8.1f %9s\n' % (width,
+                stage, row['calls'], row['seconds'], row['before'],
+                row['after'], row['depth'], row['worst'], row['memory'],
+                cache))
+        for event in self.errors:
+            stream.write('error: %s\n' % event['message'])
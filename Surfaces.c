@@ -91,8 +91,9 @@ void PezRender()
     GLenum stage = GL_TESS_EVALUATION_SHADER;
     int activeCount;
     glGetProgramStageiv(prog, stage, GL_ACTIVE_SUBROUTINE_UNIFORM_LOCATIONS, &activeCount);
-    pezCheck(activeCount == 1);
+    pezCheck(activeCount == 2);
     GLuint surfaceFunc = glGetSubroutineUniformLocation(prog, stage, "SurfaceFunc");
+    GLuint normalFunc = glGetSubroutineUniformLocation(prog, stage, "NormalFunc");
 
     // Pick the subroutine:
     float time = fmod(Scene.Time, 5);
@@ -103,13 +104,22 @@ void PezRender()
         "SuperellipseMobiusSurface",
         "SpiralSurface"
     };
+    const char* normals[] = {
+        "SimpleTorusNormal",
+        "RidgedTorusNormal",
+        "SuperellipseTorusNormal",
+        "SuperellipseMobiusNormal",
+        "SpiralNormal"
+    };
     int sel = ((int) time) % (sizeof(names) / sizeof(names[0]));
     GLuint surface = glGetSubroutineIndex(prog, stage, names[sel]);
-    static GLuint indices[1];
+    GLuint normal = glGetSubroutineIndex(prog, stage, normals[sel]);
+    static GLuint indices[2];
     bool takeScreenshot = false;
     if (indices[surfaceFunc] != surface) {
         indices[surfaceFunc] = surface;
-        glUniformSubroutinesuiv(stage, 1, indices);
+        indices[normalFunc] = normal;
+        glUniformSubroutinesuiv(stage, 2, indices);
         takeScreenshot = TakeScreenshots;
     }
 
@@ -26,20 +26,19 @@ const float f = 20;
 const float h = 0.05;
 const float Pi = 4*atan(1);
 const float n = 3;
+const float Alpha = 0.3;
 
 subroutine vec3 ParametricFunction(float u, float v);
+subroutine vec3 NormalFunction(float u, float v);
 subroutine uniform ParametricFunction SurfaceFunc;
+subroutine uniform NormalFunction NormalFunc;
 
 void main()
 {
     vec2 uv = gl_TessCoord.xy;
     vec2 p = uv * 2 * Pi;
     tePosition = SurfaceFunc(p.x, p.y);
-    float du = 0.0001; float dv = 0.0001;
-    vec3 C = SurfaceFunc(p.x + du, p.y);
-    vec3 B = SurfaceFunc(p.x, p.y + dv);
-    vec3 A = tePosition;
-    teNormal = normalize(cross(C - A, B - A));
+    teNormal = normalize(NormalFunc(p.x, p.y));
     gl_Position = Projection * Modelview * vec4(tePosition, 1);
 }
 
@@ -53,6 +52,18 @@ vec3 SimpleTorusSurface(float u, float v)
     return vec3(x, y, z);
 }
 
+subroutine(NormalFunction)
+vec3 SimpleTorusNormal(float u, float v)
+{
+    float t0 = r*cos(v);
+    float t1 = R + t0;
+    float t2 = t0*t1;
+    float x = -t2*cos(u);
+    float y = -t2*sin(u);
+    float z = r*t1*sin(v);
+    return vec3(x, y, z);
+}
+
 // Ridged Torus
 subroutine(ParametricFunction)
 vec3 RidgedTorusSurface(float u, float v)
@@ -63,6 +74,38 @@ vec3 RidgedTorusSurface(float u, float v)
     return vec3(x, y, z);
 }
 
+subroutine(NormalFunction)
+vec3 RidgedTorusNormal(float u, float v)
+{
+    float t0 = cos(u);
+    float t1 = cos(v);
+    float t2 = R*r;
+    float t3 = t1*t2;
+    float t4 = r*r;
+    float t5 = t1*t1;
+    float t6 = t4*t5;
+    float t7 = sin(u);
+    float t8 = r*t7;
+    float t9 = f*u;
+    float t10 = f*cos(t9);
+    float t11 = h*t10;
+    float t12 = sin(t9);
+    float t13 = h*t12;
+    float t14 = R*t13;
+    float t15 = t1*t14;
+    float t16 = r*t0;
+    float t17 = 2*t13;
+    float t18 = t17*t5;
+    float t19 = h*h;
+    float t20 = t10*t12*t19;
+    float t21 = t12*t12*t19;
+    float t22 = t21*t5;
+    float x = t0*t15 + t0*t22 + t0*t3 + t0*t6 + t11*t8 + t16*t18 + t20*t7;
+    float y = -t0*t20 - t11*t16 + t15*t7 + t18*t8 + t22*t7 + t3*t7 + t6*t7;
+    float z = (r*t1*t17 + t1*t21 + t1*t4 + t14 + t2)*sin(v);
+    return vec3(x, y, z);
+}
+
 // Superellipse Torus
 subroutine(ParametricFunction)
 vec3 SuperellipseTorusSurface(float u, float v)
@@ -74,6 +117,26 @@ vec3 SuperellipseTorusSurface(float u, float v)
     return vec3(x, y, z);
 }
 
+// Scaled by (|cos(v)|*|sin(v)|)^(1 - 2/n) to stay finite where the
+// superellipse has vertical tangents; see SuperellipseScale in Surfaces.py.
+subroutine(NormalFunction)
+vec3 SuperellipseTorusNormal(float u, float v)
+{
+    u /= 2; // <-- cut in half
+    float t0 = cos(v);
+    float t1 = abs(t0);
+    float t2 = 1.0/n;
+    float t3 = 2*t2;
+    float t4 = 1 - t3;
+    float t5 = 1.0*t2*(1.0*R + 0.5*pow(t1, t3)*sign(t0));
+    float t6 = t0*pow(t1, t4)*t5;
+    float t7 = sin(v);
+    float x = t6*cos(u);
+    float y = t6*sin(u);
+    float z = t5*t7*pow(abs(t7), t4);
+    return vec3(x, y, z);
+}
+
 // Superellipse Mobius
 subroutine(ParametricFunction)
 vec3 SuperellipseMobiusSurface(float u, float v)
@@ -85,15 +148,106 @@ vec3 SuperellipseMobiusSurface(float u, float v)
     return vec3(x, y, z);
 }
 
+// Scaled by (|cos(v)|*|sin(v)|)^(1 - 2/n) like SuperellipseTorusNormal.
+subroutine(NormalFunction)
+vec3 SuperellipseMobiusNormal(float u, float v)
+{
+    u /= 2; // <-- cut in half
+    float t0 = cos(u);
+    float t1 = (1.0/2.0)*u;
+    float t2 = sin(t1);
+    float t3 = R*t2;
+    float t4 = sin(v);
+    float t5 = abs(t4);
+    float t6 = 1.0/n;
+    float t7 = 2*t6;
+    float t8 = 1 - t7;
+    float t9 = t4*pow(t5, t8);
+    float t10 = 1.0*t9;
+    float t11 = t10*t3;
+    float t12 = cos(v);
+    float t13 = abs(t12);
+    float t14 = t12*pow(t13, t8);
+    float t15 = 0.25*t14;
+    float t16 = cos(t1);
+    float t17 = R*t16;
+    float t18 = t15*t17;
+    float t19 = sin(u);
+    float t20 = 0.25*t19;
+    float t21 = pow(t13, t7)*sign(t12);
+    float t22 = t2*t2;
+    float t23 = t22*t9;
+    float t24 = t21*t23;
+    float t25 = pow(t5, t7)*sign(t4);
+    float t26 = t14*t25;
+    float t27 = t22*t26;
+    float t28 = 0.015625*t19;
+    float t29 = 0.125*t0;
+    float t30 = t23*t25;
+    float t31 = t16*t16;
+    float t32 = t21*t31;
+    float t33 = t32*t9;
+    float t34 = t26*t31;
+    float t35 = t14*t32;
+    float t36 = t16*t2;
+    float t37 = t0*t36;
+    float t38 = 0.5*t21*t9;
+    float t39 = 0.03125*t26;
+    float t40 = 1.0*t6;
+    float t41 = 0.125*t19;
+    float t42 = 0.25*t0;
+    float t43 = 0.015625*t0;
+    float t44 = t19*t36;
+    float t45 = 0.125*t36;
+    float x = t40*(t0*t11 + t0*t18 - t20*t24 - t20*t33 + t27*t28 + t28*t34 + t29*t30 + t29*t35 + t37*t38 + t37*t39);
+    float y = t40*(t11*t19 + t18*t19 + t24*t42 - t27*t43 + t30*t41 + t33*t42 - t34*t43 + t35*t41 + t38*t44 + t39*t44);
+    float z = -t40*(-t10*t17 + t14*t21*t45 + t15*t3 - t25*t45*t9 + 0.03125*t27 - 0.5*t33);
+    return vec3(x, y, z);
+}
+
 // Spiral Shape
 subroutine(ParametricFunction)
 vec3 SpiralSurface(float u, float v)
 {
-    const float Alpha = 0.3;
-    float x = Alpha*(-v/(2*Pi) + 1)*(cos(u) + 1)*cos(2*v) + 0.1*cos(2*v);
-    float y = Alpha*(-v/(2*Pi) + 1)*(cos(u) + 1)*sin(2*v) + 0.1*sin(2*v);
-    float z = Alpha*(-v/(2*Pi) + 1)*sin(u) + v/(2*Pi);
-    return 2 * vec3(x, y, -z);
+    float t0 = 2*v;
+    float t1 = cos(t0);
+    float t2 = v/Pi;
+    float t3 = 2*Alpha*(1 - 1.0/2.0*t2);
+    float t4 = t3*(cos(u) + 1);
+    float t5 = sin(t0);
+    float x = t1*t4 + 0.2*t1;
+    float y = t4*t5 + 0.2*t5;
+    float z = -t2 - t3*sin(u);
+    return vec3(x, y, z);
+}
+
+subroutine(NormalFunction)
+vec3 SpiralNormal(float u, float v)
+{
+    float t0 = 2*v;
+    float t1 = sin(t0);
+    float t2 = 1.0/Pi;
+    float t3 = sin(u);
+    float t4 = Alpha*t2;
+    float t5 = 2*Alpha*(-1.0/2.0*t2*v + 1);
+    float t6 = t3*t5;
+    float t7 = t6*(-t2 + t3*t4);
+    float t8 = cos(t0);
+    float t9 = 4*Alpha;
+    float t10 = t8*t9;
+    float t11 = cos(u);
+    float t12 = t1*t4;
+    float t13 = t4*t8;
+    float t14 = t11*t12;
+    float t15 = t11*t13;
+    float t16 = -t0*t13 - t0*t15 + t10*t11 + t10 - t12 - t14 + 0.4*t8;
+    float t17 = t11*t5;
+    float t18 = t1*t9;
+    float t19 = t0*t12 + t0*t14 - 0.4*t1 - t11*t18 - t13 - t15 - t18;
+    float x = -t1*t7 + t16*t17;
+    float y = -t17*t19 + t7*t8;
+    float z = t1*t19*t6 - t16*t6*t8;
+    return vec3(x, y, z);
 }
 
 -- GS
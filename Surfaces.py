@@ -1,15 +1,20 @@
 #!/usr/bin/python
 
 from Derive import *
-from sympy import ccode, symbols
+from Glsl import FunctionName, GlslFunction
+from Polynomial import BezierBasis, PolynomialPatch
+from sympy import pi, symbols
+from Profile import JsonLines, Summary
+import argparse
+import multiprocessing
+import Derive
 from sympy.functions import Abs, sign, sin, cos
 
-# Print a vector-valued function with C syntax
-def Print(label, vvf):
-    print '// ' + label
-    print "float x =", ccode(vvf[0]) + ";"
-    print "float y =", ccode(vvf[1]) + ";"
-    print "float z =", ccode(vvf[2]) + ";"
+# Print a vector-valued function as a GLSL subroutine
+def Print(label, vvf, subroutine='ParametricFunction'):
+    source, before, after = GlslFunction(FunctionName(label), vvf, subroutine)
+    print '// %s (%d ops, %d after CSE)' % (label, before, after)
+    print source
     print
 
 def PrintDivider():
@@ -24,6 +29,12 @@ def SuperellipseYZ(n, a, b):
     y = (Abs(sin(v)) ** (2/n)) * b * sign(sin(v))
     return VVF(0, -x, y)
 
+# Positive factor for NormalFunc that cancels the |cos v|^(2/n - 1) and
+# |sin v|^(2/n - 1) in the v-derivatives of SuperellipseYZ, which blow up
+# where the superellipse has vertical tangents.
+def SuperellipseScale(n):
+    return Abs(cos(v)) ** (1 - 2/n) * Abs(sin(v)) ** (1 - 2/n)
+
 # Rotates the given vector-valued function along the X-axis
 def RotateX(f, q):
     y = f[1] * cos(q) - f[2] * sin(q)
@@ -37,82 +48,84 @@ def RotateX(f, q):
 r, R = symbols('r R', positive=True)
 h, f = symbols('h f')
 
-# Torus
-if False:
+# Each surface function returns a label, the surface and its normals.
+def Torus():
     sweepCurve = VVF(R*cos(u), R*sin(u), 0)
     crossSection = CircleYZ(r)
     surface = Sweep(sweepCurve, crossSection)
     normals = NormalFunc(surface)
-    print
-    Print('Torus Surface', surface)
-    Print('Torus Normals', normals)
-    PrintDivider()
+    return 'Torus', surface, normals
 
 # Torus with Meridian Ridges
-if False:
+def RidgedTorus():
+    sweepCurve = VVF(R*cos(u), R*sin(u), 0)
     crossSection = CircleYZ(r + h*sin(u*f))
     surface = Sweep(sweepCurve, crossSection)
     normals = NormalFunc(surface)
-    Print('Ridged Torus Surface', surface)
-    Print('Ridged Torus Normals', normals)
-    PrintDivider()
+    return 'Ridged Torus', surface, normals
 
 # Torus with a superellipse cross-section
 # sympy has trouble with derivatives when Abs is involved
-if False:
+def SuperellipseTorus():
     sweepCurve = VVF(R*cos(u), R*sin(u), 0)
     n = symbols('n')
     crossSection = SuperellipseYZ(n, 0.5, 0.5)
     surface = Sweep(sweepCurve, crossSection)
-    print
-    Print('Superellipse Torus Surface', surface)
-    PrintDivider()
+    normals = NormalFunc(surface, level=1, scale=SuperellipseScale(n))
+    return 'Superellipse Torus', surface, normals
 
 # Superellipse Mobius
 # sympy has trouble with derivatives when Abs is involved
-if False:
+def SuperellipseMobius():
     sweepCurve = VVF(R*cos(u), R*sin(u), 0)
     n = symbols('n')
     crossSection = SuperellipseYZ(n, 0.5, 0.125)
     crossSection = RotateX(crossSection, u / 2)
     surface = Sweep(sweepCurve, crossSection)
-    print
-    Print('Superellipse Mobius Surface', surface)
-    PrintDivider()
+    normals = NormalFunc(surface, level=1, scale=SuperellipseScale(n))
+    return 'Superellipse Mobius', surface, normals
 
 # Trefoil that lies on the torus (r-2)^2 + z^2 = 1
-# Causes infinite recursion in sympy...
-if False:
+# Normalizing its frame causes infinite recursion in sympy, so the frame
+# is left to runtime; see FrameSweep.
+def TrefoilOnTorus():
     x = (2 + cos(3*u))*cos(2*u)
     y = (2 + cos(3*u))*sin(2*u)
     z = sin(3*u)
     sweepCurve = VVF(x, y, z)
     crossSection = CircleYZ(radius = 1.0)
-    surface = Sweep(sweepCurve, crossSection)
-    Print('Trefoil-on-Torus Surface', surface)
-    PrintDivider()
+    surface = Sweep(sweepCurve, crossSection, frame='frenet')
+    normals = surface.Normals()
+    return 'Trefoil-on-Torus', surface, normals
 
-# Simpler Trefoil -- also causes sympy trouble.
-if False:
+# Simpler Trefoil -- also causes sympy trouble, also a runtime frame.
+def SimpleTrefoil():
     a, b, c = 0.5, 0.3, 0.5
     x = -1.5 * b * sin(1.5 * u) * cos(u) - (a + b * cos(1.5 * u)) * sin(u)
     y = -1.5 * b * sin(1.5 * u) * sin(u) + (a + b * cos(1.5 * u)) * cos(u)
     z =  1.5 * c * cos(1.5 * u)
     sweepCurve = VVF(x, y, z)
     crossSection = CircleYZ(r)
-    surface = Sweep(sweepCurve, crossSection)
-    print
-    Print('Simple Trefoil Surface', surface)
-    PrintDivider()
+    surface = Sweep(sweepCurve, crossSection, frame='frenet')
+    normals = surface.Normals()
+    return 'Simple Trefoil', surface, normals
+
+# Spiral Shape
+# Pi is a symbol, so the GLSL refers to the constant of the same name.
+def Spiral():
+    Alpha, Pi = symbols('Alpha Pi', positive=True)
+    k = Alpha * (1 - v / (2*Pi))
+    x = k * (cos(u) + 1) * cos(2*v) + 0.1 * cos(2*v)
+    y = k * (cos(u) + 1) * sin(2*v) + 0.1 * sin(2*v)
+    z = k * sin(u) + v / (2*Pi)
+    surface = VVF(2*x, 2*y, -2*z)
+    normals = NormalFunc(surface, level=0) # <-- smallest after CSE as is
+    return 'Spiral', surface, normals
 
 # Bicubic Patch
-if False:
-    B = Matrix(4,4,[
-        -1, 3, -3, 1,
-        3, -6, 3, 0,
-        -3, 3, 0, 0,
-        1, 0, 0, 0 ])
-    Bt = B.transpose()
+# Derived by coefficient arithmetic on polynomials rather than simplify;
+# see Polynomial.py.  BSplineBasis(3) gives a uniform B-spline patch.
+def BicubicPatch():
     a_thru_p = [chr(i + ord('a')) for i in xrange(16)]
     axes = 'x','y','z'
     ax_thru_pz = ["%s_%s" % (x, c) for c in axes for x in a_thru_p]
@@ -120,15 +133,117 @@ if False:
     x = Matrix(4,4,ax_thru_pz[0:16])  # a_x, b_x, c_x, ...
     y = Matrix(4,4,ax_thru_pz[16:32]) # a_y, b_y, c_y, ...
     z = Matrix(4,4,ax_thru_pz[32:48]) # a_z, b_z, c_z, ...
-    um = Matrix(1,4,[u*u*u,u*u,u,1])
-    vm = Matrix(4,1,[v*v*v,v*v,v,1])
-    x, y, z = [um * B * P * Bt * vm for P in x,y,z]
-    x, y, z = [simplify(P[0]) for P in x,y,z]
-    surface = VVF(x, y, z)
-    normals = NormalFunc(surface) # <--- this is slow
-    Print('Bicubic Patch Surface', surface)
-    Print('Bicubic Patch Normals', normals)
-    PrintDivider()
+    B = BezierBasis(3)
+    surface, normals = PolynomialPatch(B, B, [x, y, z])
+    return 'Bicubic Patch', surface, normals
+
+# All surfaces, by command-line name, with a flag for the default set
+# and the (u, v) domain they are tessellated over.
+Angles = ((0, 2*pi), (0, 2*pi))
+UnitSquare = ((0, 1), (0, 1))
+HalfTurns = ((0, 4*pi), (0, 2*pi)) # <-- curves of period 4 pi in u
+Surfaces = [
+    ('torus', Torus, False, Angles),
+    ('ridged', RidgedTorus, False, Angles),
+    ('superellipse', SuperellipseTorus, False, Angles),
+    ('mobius', SuperellipseMobius, False, Angles),
+    ('trefoil', TrefoilOnTorus, False, Angles),
+    ('simpletrefoil', SimpleTrefoil, False, HalfTurns),
+    ('spiral', Spiral, False, Angles),
+    ('bicubic', BicubicPatch, False, UnitSquare),
+]
+
+# Numeric values for evaluating the surfaces, the same as the constants
+# in the TES of Surfaces.glsl, plus a gently curved grid of control points
+# for the bicubic patch.
+Parameters = {'R': 1.5, 'r': 0.25, 'f': 20, 'h': 0.05, 'n': 3,
+              'Alpha': 0.3, 'Pi': float(pi)}
+for i, c in enumerate('abcdefghijklmnop'):
+    Parameters[c + '_x'] = (i % 4) / 3.0
+    Parameters[c + '_y'] = (i // 4) / 3.0
+    Parameters[c + '_z'] = 0.25 * ((i // 4 - 1.5) ** 2 - (i % 4 - 1.5) ** 2)
+
+def Derivation(name):
+    """Returns the label, surface and normals of the named surface, or """
+    """the DerivationError raised if one of its stages failed.        """
+    try:
+        with Stage(name):
+            return dict((s[0], s[1]) for s in Surfaces)[name]()
+    except DerivationError as error:
+        Emit('error', message=str(error))
+        return error
+
+def FrozenDerivation(name):
+    """Derivation, frozen for transport; serial runs thaw it too, so """
+    """that they print exactly what pooled runs do.                  """
+    return Freeze(Derivation(name))
+
+def PooledDerivation(name):
+    """FrozenDerivation in a worker; also returns the events it saw"""
+    events = []
+    Derive.Hooks[:] = [events.append]
+    return FrozenDerivation(name), events
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Derives parametric surfaces and prints them as GLSL.')
+    parser.add_argument('names', nargs='*', metavar='name',
+        help='surfaces to derive, any of: %s (default: those enabled in '
+             'Surfaces.py)' % ', '.join(s[0] for s in Surfaces))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help='worker processes; several surfaces are derived concurrently, '
+             'a single surface is split per matrix entry (0 = all cores)')
+    parser.add_argument('--profile', action='store_true',
+        help='print a table of time, memory and op counts per stage to '
+             'stderr')
+    parser.add_argument('--trace', metavar='FILE', type=argparse.FileType('w'),
+        help='write every instrumentation event to FILE as JSON lines')
+    parser.add_argument('--stage-timeout', type=float, metavar='SECONDS',
+        help='give up on a surface when one of its stages takes longer, '
+             'not counting the stages nested in it')
+    args = parser.parse_args()
+    summary = Summary()
+    if args.profile:
+        Derive.Hooks.append(summary)
+    if args.trace:
+        Derive.Hooks.append(JsonLines(args.trace))
+    Derive.StageTimeout = args.stage_timeout
+    names = args.names or [s[0] for s in Surfaces if s[2]]
+    for name in names:
+        if name not in [s[0] for s in Surfaces]:
+            parser.error('unknown surface: ' + name)
+    processes = args.jobs or multiprocessing.cpu_count()
+    if processes > 1 and len(names) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            outcomes = pool.map_async(PooledDerivation, names).get(
+                Derive.PoolTimeout)
+        except multiprocessing.TimeoutError:
+            pool.terminate()
+            parser.exit(1, 'no results from the pool within %d seconds\n' %
+                        Derive.PoolTimeout)
+        results = []
+        for result, events in outcomes:
+            for event in events:
+                for hook in Derive.Hooks:
+                    hook(event)
+            results.append(Thaw(result))
+        pool.close()
+    else:
+        if processes > 1:
+            UseProcessPool(processes)
+        results = [Thaw(FrozenDerivation(name)) for name in names]
+    for name, result in zip(names, results):
+        print
+        if isinstance(result, DerivationError):
+            print '// %s failed: %s' % (name, result)
+            continue
+        label, surface, normals = result
+        Print(label + ' Surface', surface)
+        Print(label + ' Normal', normals, 'NormalFunction')
+        PrintDivider()
+    if args.profile:
+        summary.Print()
 
 a = """
 // Torus Surface